@@ -1,24 +1,33 @@
 #!/usr/bin/env python3
 
+import re
 import sys
 import argparse
-from dataclasses import dataclass, fields, field, astuple
-from typing import Tuple, List, Dict, Iterator, Optional, Union, Any
+from bisect import bisect_left
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+from weakref import WeakKeyDictionary
+from dataclasses import dataclass, field, FrozenInstanceError
+from collections.abc import Iterable, Iterator
+from typing import Any, NamedTuple
 
 
-@dataclass(frozen=True)
-class VlanTag:
+class VlanTag(NamedTuple):
     vid: int
     pcp: int = 0
     tpid: int = 0x8100
     dei: int = 0
 
-    def __post_init__(self) -> None:
-        if not 0 <= self.vid <= 4094:
-            raise ValueError(f"VID must be 0-4094: {self.vid}")
+    @classmethod
+    def validated(cls, vid: int, pcp: int = 0, tpid: int = 0x8100, dei: int = 0) -> 'VlanTag':
+        # Validate at ingress only; treatment output is already constrained by VlanTagOp
+        if not 0 <= vid <= 4094:
+            raise ValueError(f"VID must be 0-4094: {vid}")
+
+        if not 0 <= pcp <= 7:
+            raise ValueError(f"PCP must be 0-7: {pcp}")
 
-        if not 0 <= self.pcp <= 7:
-            raise ValueError(f"PCP must be 0-7: {self.pcp}")
+        return cls(vid, pcp, tpid, dei)
 
     def __repr__(self) -> str:
         return f"[VID: {self.vid:>4}, PCP: {self.pcp}, TPID: 0x{self.tpid:04x}]"
@@ -26,9 +35,55 @@ class VlanTag:
     __str__ = __repr__
 
 
-@dataclass(frozen=True)
+@lru_cache(maxsize=4096)
+def make_vlan_tag(vid: int, pcp: int = 0, tpid: int = 0x8100, dei: int = 0) -> VlanTag:
+    # Interned validated tag; traffic reuses few distinct tags
+    return VlanTag.validated(vid, pcp, tpid, dei)
+
+
+def _pack_tag(tag: VlanTag) -> int:
+    # 32-bit tag layout: TPID (16) | DEI (1) | PCP (3) | VID (12)
+    vid, pcp, tpid, dei = tag
+
+    # VlanTag itself is unchecked; an oversized field would spill into its neighbours and match silently
+    if not 0 <= vid <= 4094:
+        raise ValueError(f"VID must be 0-4094: {vid}")
+
+    if not (0 <= pcp <= 7 and 0 <= dei <= 1 and 0 <= tpid <= 0xFFFF):
+        raise ValueError(f"VLAN tag field out of range: VID {vid}, PCP {pcp}, TPID 0x{tpid:04x}, DEI {dei}")
+
+    return tpid << 16 | dei << 15 | pcp << 12 | vid
+
+
+@dataclass(frozen=True, slots=True)
 class EthFrame:
-    tags: Tuple[VlanTag, ...] = field(default_factory=tuple)
+    tags: tuple[VlanTag, ...] = field(default_factory=tuple)
+    _hash: int = field(init=False, repr=False, compare=False)
+    _shape: int = field(init=False, repr=False, compare=False)
+    inner_tag: VlanTag | None = field(init=False, repr=False, compare=False)
+    outer_tag: VlanTag | None = field(init=False, repr=False, compare=False)
+    _filter_bits: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Normalize to a tuple so the frame is hashable
+        tags = tuple(self.tags)
+        object.__setattr__(self, "tags", tags)
+        object.__setattr__(self, "_hash", hash(tags))
+        # 0: untagged, 1: single tagged, 2: double tagged
+        object.__setattr__(self, "_shape", min(len(tags), 2))
+        # Inner tag is the last one in the header sequence
+        object.__setattr__(self, "inner_tag", tags[-1] if tags else None)
+        # Check length to ensure we don't accidentally grab the inner tag of a single-tagged frame
+        object.__setattr__(self, "outer_tag", tags[-2] if len(tags) >= 2 else None)
+        # Filter-relevant state packed as shape | outer tag | inner tag for VlanTagOp matching
+        object.__setattr__(self, "_filter_bits", (
+            self._shape << 64 |
+            (_pack_tag(self.outer_tag) << 32 if self.outer_tag else 0) |
+            (_pack_tag(self.inner_tag) if self.inner_tag else 0)
+        ))
+
+    def __hash__(self) -> int:
+        return self._hash
 
     def __repr__(self) -> str:
         return "EthFrame(Untagged)" if not self.tags else f"EthFrame(Tags: {', '.join(repr(t) for t in self.tags)})"
@@ -44,13 +99,13 @@ class EthFrame:
 
     @classmethod
     def from_single_tag(cls, vlan: int, pcp: int = 0) -> 'EthFrame':
-        return cls(tags=[VlanTag(vid=vlan, pcp=pcp)])
+        return cls(tags=[make_vlan_tag(vlan, pcp)])
 
     @classmethod
     def from_double_tag(cls, outer_vid: int, inner_vid: int, outer_pcp: int = 0, inner_pcp: int = 0) -> 'EthFrame':
         return cls(tags=[
-            VlanTag(vid=outer_vid, pcp=outer_pcp),
-            VlanTag(vid=inner_vid, pcp=inner_pcp)
+            make_vlan_tag(outer_vid, outer_pcp),
+            make_vlan_tag(inner_vid, inner_pcp)
         ])
 
     @classmethod
@@ -59,90 +114,247 @@ class EthFrame:
 
     @property
     def is_raw(self) -> bool:
-        return len(self.tags) == 0
+        return self._shape == 0
 
     @property
     def is_single_tagged(self) -> bool:
-        return len(self.tags) == 1
+        return self._shape == 1
 
     @property
     def is_double_tagged(self) -> bool:
-        return len(self.tags) >= 2
+        return self._shape == 2
+
+
+# Whitespace-separated table row of 15 decimal fields, matched per line of the whole text
+_TABLE_ROW_RE = re.compile(r"^[^\S\n]*" + r"(\d+)[^\S\n]+" * 14 + r"(\d+)[^\S\n]*$", re.MULTILINE)
+# Row groups in VlanTagOp field order (columns 7 and 8 swapped)
+_TABLE_ROW_GROUPS = (1, 2, 3, 4, 5, 6, 8, 7, 9, 10, 11, 12, 13, 14, 15)
+
+_F_PRIO_VALID = frozenset({*range(9), 14, 15})
+_T_PRIO_VALID = frozenset({*range(11), 15})
+_F_VID_VALID = frozenset({*range(4095), 4096})
+_T_VID_VALID = frozenset({*range(4095), 4096, 4097})
+_F_TPID_VALID = frozenset({0, 4, 5, 6, 7})
+
+# VlanTagOp field domains (name, valid values, error) in field order
+_FIELD_DOMAINS = (
+    ("f_out_prio", _F_PRIO_VALID, "invalid priority"),
+    ("f_out_vid",  _F_VID_VALID,  "out of range"),
+    ("f_out_tpid", _F_TPID_VALID, "invalid enum"),
+    ("f_in_prio",  _F_PRIO_VALID, "invalid priority"),
+    ("f_in_vid",   _F_VID_VALID,  "out of range"),
+    ("f_in_tpid",  _F_TPID_VALID, "invalid enum"),
+    ("f_ext_crit", range(3),      "invalid enum"),
+    ("f_eth_type", range(6),      "invalid enum"),
+    ("tag_rem",    range(4),      "invalid enum"),
+    ("t_out_prio", _T_PRIO_VALID, "invalid priority"),
+    ("t_out_vid",  _T_VID_VALID,  "out of range"),
+    ("t_out_tpid", range(8),      "invalid enum"),
+    ("t_in_prio",  _T_PRIO_VALID, "invalid priority"),
+    ("t_in_vid",   _T_VID_VALID,  "out of range"),
+    ("t_in_tpid",  range(8),      "invalid enum"),
+)
+
+# VlanTagOp field values in field order
+_op_fields = attrgetter(*(name for name, _, _ in _FIELD_DOMAINS))
+_op_sort_key = attrgetter("_sort_key")
+
+
+def _pack_tag_filter(prio: int, vid: int, tpid_dei: int, input_tpid: int) -> tuple[int, int]:
+    # (value, mask) of one tag filter over the _pack_tag() layout; wildcard fields are unmasked
+    bits = mask = 0
+
+    if vid != 4096:
+        bits |= vid
+        mask |= 0xFFF
+
+    if prio < 8:
+        bits |= prio << 12
+        mask |= 0x7 << 12
+
+    match tpid_dei:
+        case 4:  # TPID 0x8100
+            bits |= 0x8100 << 16
+            mask |= 0xFFFF << 16
+        case 5:  # Input TPID
+            bits |= input_tpid << 16
+            mask |= 0xFFFF << 16
+        case 6:  # Input TPID, DEI = 0
+            bits |= input_tpid << 16
+            mask |= 0xFFFF << 16 | 1 << 15
+        case 7:  # Input TPID, DEI = 1
+            bits |= input_tpid << 16 | 1 << 15
+            mask |= 0xFFFF << 16 | 1 << 15
+
+    return bits, mask
+
+
+# Treatment priority copy resolvers (frame) indexed by enum - 8; 0-7 are literal
+_PCP_COPIES = (
+    lambda frame: frame.inner_tag.pcp if frame.inner_tag else 0,  # 8: Copy from inner priority of received frame
+    lambda frame: frame.outer_tag.pcp if frame.outer_tag else 0,  # 9: Copy from outer priority of received frame
+    lambda frame: 0,                                              # 10: DSCP to P-bit mapping (Defaulting to 0)
+)
+
+# Treatment VID copy resolvers (frame) indexed by enum - 4096; 0-4094 are literal
+_VID_COPIES = (
+    lambda frame: frame.inner_tag.vid if frame.inner_tag else 0,  # 4096: Copy from inner VID of received frame
+    lambda frame: frame.outer_tag.vid if frame.outer_tag else 0,  # 4097: Copy from outer VID of received frame
+)
+
+# Treatment TPID/DEI resolvers (frame, output_tpid) indexed by enum
+_TPID_DEI_RESOLVERS = (
+    # 0: Copy TPID/DEI from inner
+    lambda frame, tpid: (frame.inner_tag.tpid, frame.inner_tag.dei) if frame.inner_tag else (0x8100, 0),
+    # 1: Copy TPID/DEI from outer
+    lambda frame, tpid: (frame.outer_tag.tpid, frame.outer_tag.dei) if frame.outer_tag else (0x8100, 0),
+    # 2: Use Output TPID, Copy DEI from inner
+    lambda frame, tpid: (tpid, frame.inner_tag.dei if frame.inner_tag else 0),
+    # 3: Use Output TPID, Copy DEI from outer
+    lambda frame, tpid: (tpid, frame.outer_tag.dei if frame.outer_tag else 0),
+    # 4: Set TPID 0x8100 (Implicit DEI=0 or preserved)
+    lambda frame, tpid: (0x8100, 0),
+    # 5: Reserved or fallback
+    lambda frame, tpid: (tpid, 0),
+    # 6: Use Output TPID, Set DEI = 0
+    lambda frame, tpid: (tpid, 0),
+    # 7: Use Output TPID, Set DEI = 1
+    lambda frame, tpid: (tpid, 1),
+)
+
+
+def _resolve_pcp(prio: int, frame: EthFrame) -> int:
+    return prio if prio < 8 else _PCP_COPIES[prio - 8](frame)
+
+
+def _resolve_vid(vid: int, frame: EthFrame) -> int:
+    return vid if vid <= 4094 else _VID_COPIES[vid - 4096](frame)
+
+
+def _resolve_tpid_dei(tpid_dei: int, frame: EthFrame, output_tpid: int) -> tuple[int, int]:
+    return _TPID_DEI_RESOLVERS[tpid_dei](frame, output_tpid)
 
-    @property
-    def inner_tag(self) -> Optional[VlanTag]:
-        # Inner tag is the last one in the header sequence
-        # Negative indexing prevents IndexError if the list is empty.
-        return self.tags[-1] if self.tags else None
 
-    @property
-    def outer_tag(self) -> Optional[VlanTag]:
-        # Check length to ensure we don't accidentally grab the inner tag of a single-tagged frame
-        return self.tags[-2] if len(self.tags) >= 2 else None
-
-
-@dataclass(frozen=True)
 class VlanTagOp:
     # CAUTION: field order must match bit-stream for sorting
-    # filter fields
-    f_out_prio: int
-    f_out_vid: int
-    f_out_tpid: int
-    f_in_prio: int
-    f_in_vid: int
-    f_in_tpid: int
-    f_ext_crit: int
-    f_eth_type: int
-    # treatment fields
-    tag_rem: int
-    t_out_prio: int
-    t_out_vid: int
-    t_out_tpid: int
-    t_in_prio: int
-    t_in_vid: int
-    t_in_tpid: int
-
-    def __post_init__(self) -> None:
-        for field in fields(self):
-            name = field.name
+    # Instances are frozen after __init__; the cached invariants are derived from the fields
+    __slots__ = (
+        # filter fields
+        "f_out_prio", "f_out_vid", "f_out_tpid",
+        "f_in_prio", "f_in_vid", "f_in_tpid",
+        "f_ext_crit", "f_eth_type",
+        # treatment fields
+        "tag_rem",
+        "t_out_prio", "t_out_vid", "t_out_tpid",
+        "t_in_prio", "t_in_vid", "t_in_tpid",
+        # cached invariants (set in __init__)
+        "_sort_key", "_default_kind", "_is_drop_treatment", "_filter_shape",
+        "_filter_bits", "_filter_mask",
+    )
+
+    def __init__(
+        self,
+        f_out_prio: int,
+        f_out_vid: int,
+        f_out_tpid: int,
+        f_in_prio: int,
+        f_in_vid: int,
+        f_in_tpid: int,
+        f_ext_crit: int,
+        f_eth_type: int,
+        tag_rem: int,
+        t_out_prio: int,
+        t_out_vid: int,
+        t_out_tpid: int,
+        t_in_prio: int,
+        t_in_vid: int,
+        t_in_tpid: int
+    ) -> None:
+        # Instances are frozen, so slots are written through object.__setattr__
+        _set = object.__setattr__
+
+        # filter fields
+        _set(self, "f_out_prio", f_out_prio)
+        _set(self, "f_out_vid", f_out_vid)
+        _set(self, "f_out_tpid", f_out_tpid)
+        _set(self, "f_in_prio", f_in_prio)
+        _set(self, "f_in_vid", f_in_vid)
+        _set(self, "f_in_tpid", f_in_tpid)
+        _set(self, "f_ext_crit", f_ext_crit)
+        _set(self, "f_eth_type", f_eth_type)
+        # treatment fields
+        _set(self, "tag_rem", tag_rem)
+        _set(self, "t_out_prio", t_out_prio)
+        _set(self, "t_out_vid", t_out_vid)
+        _set(self, "t_out_tpid", t_out_tpid)
+        _set(self, "t_in_prio", t_in_prio)
+        _set(self, "t_in_vid", t_in_vid)
+        _set(self, "t_in_tpid", t_in_tpid)
+
+        for name, domain, error in _FIELD_DOMAINS:
             val = getattr(self, name)
 
-            match name.split("_"):
-                case ["f", _, "prio"]:
-                    if val not in {*range(9), 14, 15}:
-                        raise ValueError(f"'{name}' invalid priority: {val}")
-                case ["t", _, "prio"]:
-                    if val not in {*range(11), 15}:
-                        raise ValueError(f"'{name}' invalid priority: {val}")
-                case ["f", _, "vid"]:
-                    if not (0 <= val <= 4094 or val == 4096):
-                        raise ValueError(f"'{name}' out of range: {val}")
-                case ["t", _, "vid"]:
-                    if not (0 <= val <= 4094 or val in (4096, 4097)):
-                        raise ValueError(f"'{name}' out of range: {val}")
-                case ["f", _, "tpid"]:
-                    if val not in (0, 4, 5, 6, 7):
-                        raise ValueError(f"'{name}' invalid enum: {val}")
-                case ["t", _, "tpid"]:
-                    if not 0 <= val <= 7:
-                        raise ValueError(f"'{name}' invalid enum: {val}")
-                case ["f", "ext", "crit"]:
-                    if not 0 <= val <= 2:
-                        raise ValueError(f"'{name}' invalid enum: {val}")
-                case ["f", "eth", "type"]:
-                    if not 0 <= val <= 5:
-                        raise ValueError(f"'{name}' invalid enum: {val}")
-                case ["tag", "rem"]:
-                    if not 0 <= val <= 3:
-                        raise ValueError(f"'{name}' invalid enum: {val}")
-                case _:
-                    continue
+            if val not in domain:
+                raise ValueError(f"'{name}' {error}: {val}")
+
+        # Invariants of the op, cached for the sort key and classifier
+        # Default rule kind: 0: none, 1: untagged, 2: single tagged, 3: double tagged
+        default_kind = 0
+
+        if f_out_vid == 4096 and f_in_vid == 4096 and f_ext_crit == 0:
+            match (f_out_prio, f_in_prio):
+                case (15, 15):
+                    default_kind = 1
+                case (15, 14):
+                    default_kind = 2
+                case (14, 14):
+                    default_kind = 3
+
+        _set(self, "_default_kind", default_kind)
+
+        # Filter fields packed into their bit-stream words, cached as the table sort key
+        # Bit 64 sorts default rules last
+        _set(self, "_sort_key", (
+            (default_kind != 0) << 64 |
+            # Word 1
+            f_out_prio << 60 |
+            f_out_vid  << 47 |
+            f_out_tpid << 44 |
+            # Word 2
+            f_in_prio  << 28 |
+            f_in_vid   << 15 |
+            f_in_tpid  << 12 |
+            f_ext_crit << 4  |
+            f_eth_type
+        ))
+
+        _set(self, "_is_drop_treatment", tag_rem == 3)
+        # 0: untagged, 1: single tagged, 2: double tagged (matches EthFrame._shape)
+        _set(self, "_filter_shape", (
+            2 if f_out_prio != 15 else
+            1 if f_in_prio != 15 else
+            0
+        ))
+        # Filter packed as (value, mask) over EthFrame._filter_bits for the default input TPID
+        filter_bits, filter_mask = self._pack_filter(0x8100)
+        _set(self, "_filter_bits", filter_bits)
+        _set(self, "_filter_mask", filter_mask)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise FrozenInstanceError(f"cannot assign to field {name!r}")
+
+    def __delattr__(self, name: str) -> None:
+        raise FrozenInstanceError(f"cannot delete field {name!r}")
+
+    def __reduce__(self) -> tuple[type, tuple[int, ...]]:
+        # Rebuild through __init__ on copy/pickle, as slot state cannot be restored by setattr
+        return self.__class__, _op_fields(self)
 
     def __repr__(self) -> str:
         if self.is_drop_treatment:
             return "Dropped"
 
-        vals = astuple(self)
+        vals = _op_fields(self)
 
         f = " ".join(f"{v:>4}" for v in vals[:8])
         t = " ".join(f"{v:>4}" for v in vals[8:])
@@ -151,6 +363,16 @@ class VlanTagOp:
 
     __str__ = __repr__
 
+    # Value based equality and hashing rely on the fields being frozen
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+
+        return _op_fields(self) == _op_fields(other)
+
+    def __hash__(self) -> int:
+        return hash(_op_fields(self))
+
     @classmethod
     def from_bytes(cls, data: bytes) -> 'VlanTagOp':
         if len(data) != 16:
@@ -189,59 +411,31 @@ class VlanTagOp:
 
     @property
     def is_untagged_filter(self) -> bool:
-        return (
-            self.f_out_prio == 15 and
-            self.f_in_prio == 15
-        )
+        return self._filter_shape == 0
 
     @property
     def is_single_tagged_filter(self) -> bool:
-        return (
-            self.f_out_prio == 15 and
-            self.f_in_prio != 15
-        )
+        return self._filter_shape == 1
 
     @property
     def is_double_tagged_filter(self) -> bool:
-        return self.f_out_prio != 15
+        return self._filter_shape == 2
 
     @property
     def is_untagged_default(self) -> bool:
-        return (
-            self.f_out_prio == 15 and
-            self.f_out_vid == 4096 and
-            self.f_in_prio == 15 and
-            self.f_in_vid == 4096 and
-            self.f_ext_crit == 0
-        )
+        return self._default_kind == 1
 
     @property
     def is_single_tagged_default(self) -> bool:
-        return (
-            self.f_out_prio == 15 and
-            self.f_out_vid == 4096 and
-            self.f_in_prio == 14 and
-            self.f_in_vid == 4096 and
-            self.f_ext_crit == 0
-        )
+        return self._default_kind == 2
 
     @property
     def is_double_tagged_default(self) -> bool:
-        return (
-            self.f_out_prio == 14 and
-            self.f_out_vid == 4096 and
-            self.f_in_prio == 14 and
-            self.f_in_vid == 4096 and
-            self.f_ext_crit == 0
-        )
+        return self._default_kind == 3
 
     @property
     def is_default(self) -> bool:
-        return (
-            self.is_untagged_default or
-            self.is_single_tagged_default or
-            self.is_double_tagged_default
-        )
+        return self._default_kind != 0
 
     @property
     def is_transparent_treatment(self) -> bool:
@@ -276,131 +470,107 @@ class VlanTagOp:
 
     @property
     def is_drop_treatment(self) -> bool:
-        return self.tag_rem == 3
+        return self._is_drop_treatment
 
-    def matches_filter(self, frame: EthFrame, input_tpid: int = 0x8100) -> bool:
-        def check_tpid(tpid_dei: int, tag: VlanTag) -> bool:
-            match tpid_dei:
-                case 0:
-                    return True
-                case 4:
-                    return tag.tpid == 0x8100
-                case 5:
-                    return tag.tpid == input_tpid
-                case 6:
-                    return tag.tpid == input_tpid and tag.dei == 0
-                case 7:
-                    return tag.tpid == input_tpid and tag.dei == 1
-                case _:
-                    return False
-
-        if frame.is_raw and not self.is_untagged_filter:
-            return False
-        if frame.is_single_tagged and not self.is_single_tagged_filter:
-            return False
-        if frame.is_double_tagged and not self.is_double_tagged_filter:
-            return False
+    def _pack_filter(self, input_tpid: int) -> tuple[int, int]:
+        # An oversized TPID would spill past the tag mask and match silently
+        if not 0 <= input_tpid <= 0xFFFF:
+            raise ValueError(f"Input TPID must be 0x0000-0xFFFF: {input_tpid:#x}")
+
+        # Shape is always matched; wildcard fields of the matched tags stay unmasked
+        bits = self._filter_shape << 64
+        mask = 0x3 << 64
 
         # Outer Tag Match
-        if frame.is_double_tagged:
-            tag = frame.outer_tag
-            if not check_tpid(self.f_out_tpid, tag):
-                return False
-            if self.f_out_prio < 8 and self.f_out_prio != tag.pcp:
-                return False
-            if self.f_out_vid not in (4096, tag.vid):
-                return False
+        if self._filter_shape == 2:
+            tag_bits, tag_mask = _pack_tag_filter(self.f_out_prio, self.f_out_vid, self.f_out_tpid, input_tpid)
+            bits |= tag_bits << 32
+            mask |= tag_mask << 32
 
         # Inner Tag Match
-        if not frame.is_raw:
-            tag = frame.inner_tag
-            if not check_tpid(self.f_in_tpid, tag):
-                return False
-            if self.f_in_prio < 8 and self.f_in_prio != tag.pcp:
-                return False
-            if self.f_in_vid not in (4096, tag.vid):
-                return False
+        if self._filter_shape:
+            tag_bits, tag_mask = _pack_tag_filter(self.f_in_prio, self.f_in_vid, self.f_in_tpid, input_tpid)
+            bits |= tag_bits
+            mask |= tag_mask
+
+        return bits, mask
 
-        return True
+    def matches_filter(self, frame: EthFrame, input_tpid: int = 0x8100) -> bool:
+        bits = self._filter_bits if input_tpid == 0x8100 else self._pack_filter(input_tpid)[0]
+
+        return (frame._filter_bits ^ bits) & self._filter_mask == 0
 
     def apply_treatment(self, frame: EthFrame, output_tpid: int = 0x8100) -> EthFrame:
-        def resolve_pcp(prio: int) -> int:
-            match prio:
-                case p if 0 <= p <= 7:
-                    return p
-                case 8:   # Copy from inner priority of received frame
-                    return frame.inner_tag.pcp if frame.inner_tag else 0
-                case 9:   # Copy from outer priority of received frame
-                    return frame.outer_tag.pcp if frame.outer_tag else 0
-                case 10:  # DSCP to P-bit mapping (Defaulting to 0)
-                    return 0
-                case _:
-                    return 0
-
-        def resolve_vid(vid: int) -> int:
-            match vid:
-                case v if 0 <= v <= 4094:
-                    return v
-                case 4096:  # Copy from inner VID of received frame
-                    return frame.inner_tag.vid if frame.inner_tag else 0
-                case 4097:  # Copy from outer VID of received frame
-                    return frame.outer_tag.vid if frame.outer_tag else 0
-                case _:
-                    return 0
-
-        def resolve_tpid_dei(tpid_dei: int) -> tuple[int, int]:
-            match tpid_dei:
-                case 0:  # Copy TPID/DEI from inner
-                    return (frame.inner_tag.tpid, frame.inner_tag.dei) if frame.inner_tag else (0x8100, 0)
-                case 1:  # Copy TPID/DEI from outer
-                    return (frame.outer_tag.tpid, frame.outer_tag.dei) if frame.outer_tag else (0x8100, 0)
-                case 2:  # Use Output TPID, Copy DEI from inner
-                    return (output_tpid, frame.inner_tag.dei if frame.inner_tag else 0)
-                case 3:  # Use Output TPID, Copy DEI from outer
-                    dei = frame.outer_tag.dei if frame.outer_tag else 0
-                    return (output_tpid, dei)
-                case 4:  # Set TPID 0x8100 (Implicit DEI=0 or preserved)
-                    return (0x8100, 0)
-                case 6:  # Use Output TPID, Set DEI = 0
-                    return (output_tpid, 0)
-                case 7:  # Use Output TPID, Set DEI = 1
-                    return (output_tpid, 1)
-                case _:  # Reserved or fallback
-                    return (output_tpid, 0)
+        if not 0 <= output_tpid <= 0xFFFF:
+            raise ValueError(f"Output TPID must be 0x0000-0xFFFF: {output_tpid:#x}")
 
         if self.is_drop_treatment:
             return None
 
+        # Treatment values are constrained by VlanTagOp validation, build tags unchecked
         tags = []
 
         # Outer Treatment (S-Tag)
         if self.t_out_prio != 15:
-            tags.append(VlanTag(
-                resolve_vid(self.t_out_vid),
-                resolve_pcp(self.t_out_prio),
-                *resolve_tpid_dei(self.t_out_tpid)
-            ))
+            tags.append(VlanTag._make((
+                _resolve_vid(self.t_out_vid, frame),
+                _resolve_pcp(self.t_out_prio, frame),
+                *_resolve_tpid_dei(self.t_out_tpid, frame, output_tpid)
+            )))
 
         # Inner Treatment (C-Tag)
         if self.t_in_prio != 15:
-            tags.append(VlanTag(
-                resolve_vid(self.t_in_vid),
-                resolve_pcp(self.t_in_prio),
-                *resolve_tpid_dei(self.t_in_tpid)
-            ))
+            tags.append(VlanTag._make((
+                _resolve_vid(self.t_in_vid, frame),
+                _resolve_pcp(self.t_in_prio, frame),
+                *_resolve_tpid_dei(self.t_in_tpid, frame, output_tpid)
+            )))
 
         return EthFrame(tags=(*tags, *frame.tags[self.tag_rem:]))
 
 
 class VlanTagOpTable:
-    def __init__(self, ops: List[VlanTagOp] = None) -> None:
-        # CAUTION: VlanTagOp field order must match bit-stream for sorting
-        # Slicing the first 8 fields is a 'lossy' sort key because the upstream parser discards the
+    def __init__(self, ops: list[VlanTagOp] = None) -> None:
+        # CAUTION: VlanTagOp sort key must pack the filter fields in bit-stream order
+        # The packed filter words are a 'lossy' sort key because the upstream parser discards the
         # padding/reserved bits (assume the bits are normalized across rules)
         # Default rules last
-        self._ops = sorted(ops or [], key=lambda op: (1 if op.is_default else 0, astuple(op)[:8]))
+        self._ops = sorted(ops or [], key=_op_sort_key)
+        # Default rules (sort key bit 64) start here
+        self._default_start = bisect_left(self._ops, 1 << 64, key=_op_sort_key)
+
+        # Rules bucketed by filter shape (untagged, single, double tagged) in table order
+        # A frame can only match rules of its own shape, so lookups skip the other buckets
+        self._by_shape = ([], [], [])
+
+        for op in self._ops:
+            self._by_shape[op._filter_shape].append(op)
+
+        # Tagged buckets are further indexed on their most selective filter field, the VID of the
+        # single tag or of the outer tag. Each VID maps to the rules filtering on that VID or on any
+        # VID (4096), in table order; frames with an unindexed VID only need the wildcard rules.
+        self._vid_index = ({}, {}, {})
+        self._vid_wildcards = ([], [], [])
+
+        for shape, filter_vid in ((1, attrgetter("f_in_vid")), (2, attrgetter("f_out_vid"))):
+            index = self._vid_index[shape]
+            wildcards = self._vid_wildcards[shape]
+
+            for op in self._by_shape[shape]:
+                vid = filter_vid(op)
+
+                if vid == 4096:
+                    wildcards.append(op)
+
+                    for rules in index.values():
+                        rules.append(op)
+                else:
+                    if vid not in index:
+                        index[vid] = list(wildcards)
 
-    def __getitem__(self, index: Union[int, slice]) -> Union[VlanTagOp, List[VlanTagOp]]:
+                    index[vid].append(op)
+
+    def __getitem__(self, index: int | slice) -> VlanTagOp | list[VlanTagOp]:
         return self._ops[index]
 
     def __len__(self) -> int:
@@ -424,29 +594,29 @@ class VlanTagOpTable:
         return table
 
     @classmethod
-    def from_table_stream(cls, stream: List[str]) -> 'VlanTagOpTable':
+    def from_table_stream(cls, stream: list[str]) -> 'VlanTagOpTable':
         ops = []
 
-        for line in stream:
-            op = line.split()
-
-            if len(op) == 15 and all(map(lambda x: x.isdigit(), op)):
-                vals = [int(x) for x in op]
-
-                # OLT deletion check (last 8 bytes = 0xFF)
-                # 8191 is an invalid VID, confirming bits were all 1s (normalized)
-                if tuple(vals[8:]) == (3, 15, 8191, 7, 15, 8191, 7):
-                    continue
+        # Scan the whole text at once rather than matching line by line
+        for m in _TABLE_ROW_RE.finditer("\n".join(stream)):
+            # Fix order to match bit-stream (Ethertype before extended criteria in the dump)
+            vals = list(map(int, m.group(*_TABLE_ROW_GROUPS)))
 
-                # Fix order to match bit-stream
-                vals[6], vals[7] = vals[7], vals[6]
+            # OLT deletion check (last 8 bytes = 0xFF)
+            # 8191 is an invalid VID, confirming bits were all 1s (normalized)
+            if (
+                vals[10] == 8191 and vals[13] == 8191 and
+                vals[8] == 3 and vals[9] == 15 and vals[11] == 7 and
+                vals[12] == 15 and vals[14] == 7
+            ):
+                continue
 
-                ops.append(VlanTagOp(*vals))
+            ops.append(VlanTagOp(*vals))
 
         return cls(ops)
 
     @classmethod
-    def from_hex_stream(cls, lines: List[str]) -> 'VlanTagOpTable':
+    def from_hex_stream(cls, lines: list[str]) -> 'VlanTagOpTable':
         ops = []
 
         for line in lines:
@@ -459,68 +629,139 @@ class VlanTagOpTable:
 
         return cls(ops)
 
-    def process_frame(self, frame: EthFrame) -> Optional[EthFrame]:
-        for op in self:
-            if op.matches_filter(frame):
+    def _candidates(self, frame: EthFrame) -> list[VlanTagOp]:
+        match frame._shape:
+            case 1:
+                vid = frame.inner_tag.vid
+            case 2:
+                vid = frame.outer_tag.vid
+            case _:
+                return self._by_shape[0]
+
+        return self._vid_index[frame._shape].get(vid, self._vid_wildcards[frame._shape])
+
+    def process_frame(self, frame: EthFrame) -> EthFrame | None:
+        bits = frame._filter_bits
+
+        # Inlined VlanTagOp.matches_filter for the default input TPID
+        for op in self._candidates(frame):
+            if (bits ^ op._filter_bits) & op._filter_mask == 0:
                 return op.apply_treatment(frame)
 
         return None
 
+    def process_frames(self, frames: Iterable[EthFrame]) -> list[EthFrame | None]:
+        # Frames are hashable, so each distinct frame in a batch is classified only once
+        results = {}
+        pon_frames = []
+
+        for frame in frames:
+            if frame not in results:
+                results[frame] = self.process_frame(frame)
+
+            pon_frames.append(results[frame])
+
+        return pon_frames
+
 
 class VlanClassifier:
+    # Per table (service candidates, rankings by target priority), freed along with the table
+    _rankings = WeakKeyDictionary()
+
+    @staticmethod
+    def _service_candidates(table: VlanTagOpTable | Iterable[VlanTagOp]) -> list[tuple[int, VlanTagOp, float, float]]:
+        # Target priority independent part of the ranking:
+        # (index, op, VLAN range prior, VID translation bonus) per eligible single tagged rule
+        candidates = []
+
+        # Defaults sort last in a table, so only its non-default prefix can hold candidates
+        ops = table[:table._default_start] if isinstance(table, VlanTagOpTable) else table
+
+        for i, op in enumerate(ops):
+            if op._filter_shape == 1 and not (op._is_drop_treatment or op.f_in_vid >= 4094):
+                candidates.append((
+                    i,
+                    op,
+                    # Prioritize standard 802.1Q VLAN range (1-4094), excluding priority-tagged
+                    0.5 * (0.95 if 1 <= op.f_in_vid <= 4094 else 0.05),
+                    # Bonus for VID translation
+                    0.85 if op.t_in_vid != op.f_in_vid and op.t_in_vid <= 4094 else 0.82
+                ))
+
+        return candidates
+
     @staticmethod
-    def rank_vlan_from_priority(table: VlanTagOpTable, target_prio: int = 0) -> List[Dict[str, Any]]:
-        def calc_likelihood(op):
-            likelihood = 0.5
-            weight = 0.40 # Default weight for treatment copy priority (8)
-
-            # Prioritize standard 802.1Q VLAN range (1-4094), excluding priority-tagged
-            likelihood *= 0.95 if 1 <= op.f_in_vid <= 4094 else 0.05
-
-            # Ingress filter analysis
-            match op.f_in_prio:
-                case p if p == target_prio:
-                    likelihood *= 0.90
-                    weight = 0.70  # Upgrade trust for direct match
-                case 8:
-                    likelihood *= 0.50 if target_prio == 0 else 0.10
-                case _:
-                    likelihood *= 0.05
-
-            # Egress treatment analysis
-            match op.t_in_prio:
-                case p if p == target_prio:
-                    likelihood *= 0.999 if target_prio != 0 else 0.95
-                case 8:
-                    likelihood *= weight if target_prio != 0 else 0.85
-                case _:
-                    likelihood *= 0.0001 # Disqualifier
-
-            # Bonus for VID translation
-            likelihood *= 0.85 if op.t_in_vid != op.f_in_vid and op.t_in_vid <= 4094 else 0.82
-
-            return likelihood
-
-        results = []
+    def _rank_candidates(
+        candidates: list[tuple[int, VlanTagOp, float, float]],
+        target_prio: int
+    ) -> tuple[tuple[float, int, int, float], ...]:
+        # Per-target factor tables, built once per call instead of matched per op
+        # Treatment copy priority (8) weight: 0.40 by default, upgraded to 0.70 for a direct match
+        copy_weight = 0.40 if target_prio != 0 else 0.85
+        direct_weight = 0.70 if target_prio != 0 else 0.85
+
+        # Ingress filter analysis: f_in_prio -> (factor, treatment copy priority weight)
+        ingress = {
+            8: (0.50 if target_prio == 0 else 0.10, copy_weight),
+            target_prio: (0.90, direct_weight)
+        }
+        ingress_other = (0.05, copy_weight)
+
+        # Egress treatment analysis for a direct match
+        egress_direct = 0.999 if target_prio != 0 else 0.95
+
+        scores = []
         total_lik = 0.0
 
-        for i, op in enumerate(table):
-            if op.is_single_tagged_filter and not (op.is_single_tagged_default or op.is_drop_treatment or op.f_in_vid >= 4094):
-                total_lik += (likelihood := calc_likelihood(op))
+        for i, op, prior, translation in candidates:
+            in_factor, copy_factor = ingress.get(op.f_in_prio, ingress_other)
 
-                results.append({
-                    "vid": op.f_in_vid,
-                    "likelihood": likelihood,
-                    "index": i
-                })
+            t_prio = op.t_in_prio
+            out_factor = (
+                egress_direct if t_prio == target_prio else
+                copy_factor if t_prio == 8 else
+                0.0001  # Disqualifier
+            )
+
+            # Bonus for VID translation (precomputed)
+            total_lik += (likelihood := prior * in_factor * out_factor * translation)
+            scores.append((likelihood, op.f_in_vid, i))
+
+        scores.sort(key=itemgetter(0), reverse=True)
 
         # Normalize
-        for r in results:
-            r["confidence"] = round((r["likelihood"] / total_lik) * 100, 2) if total_lik > 0 else 0.0
+        scale = 100.0 / total_lik if total_lik > 0 else 0.0
 
-        results.sort(key=lambda x: x["likelihood"], reverse=True)
+        return tuple((likelihood, vid, i, round(likelihood * scale, 2)) for likelihood, vid, i in scores)
 
-        return results
+    @staticmethod
+    def rank_vlan_from_priority(
+        table: VlanTagOpTable | Iterable[VlanTagOp],
+        target_prio: int = 0
+    ) -> list[dict[str, Any]]:
+        if isinstance(table, VlanTagOpTable):
+            # Tables and their ops are frozen once built, so rankings are memoized per table
+            if (memo := VlanClassifier._rankings.get(table)) is None:
+                memo = VlanClassifier._rankings[table] = (VlanClassifier._service_candidates(table), {})
+
+            candidates, rankings = memo
+
+            if (ranking := rankings.get(target_prio)) is None:
+                ranking = rankings[target_prio] = VlanClassifier._rank_candidates(candidates, target_prio)
+        else:
+            # Plain sequences of ops are ranked uncached
+            ranking = VlanClassifier._rank_candidates(VlanClassifier._service_candidates(table), target_prio)
+
+        # Fresh result records per call, so callers may mutate them without poisoning the cache
+        return [
+            {
+                "vid": vid,
+                "likelihood": likelihood,
+                "index": i,
+                "confidence": confidence
+            }
+            for likelihood, vid, i, confidence in ranking
+        ]
 
 
 def main() -> None:
@@ -568,8 +809,7 @@ def main() -> None:
     print("-"*120)
     print(f"{'WAN CONFIG':<15} {'UNI FRAME':<50} PON FRAME")
     print("-"*120)
-    for conf, uni_frame in frames.items():
-        pon_frame = table.process_frame(uni_frame)
+    for (conf, uni_frame), pon_frame in zip(frames.items(), table.process_frames(frames.values())):
         print(f"{conf:<15}", f"{uni_frame!s:<50}", f"{pon_frame!s}" if pon_frame else "DISCARDED")
 
 